@@ -2,12 +2,24 @@
 import sys
 import re
 import argparse
-import unittest
 import json
+import gzip
 import os
+import socket
 import tempfile
-from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
-from urllib.parse import urlparse, parse_qs, unquote
+import shutil
+import time
+import copy
+import threading
+import queue
+import subprocess
+from collections import OrderedDict
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+import urllib.request
+from urllib.parse import urlparse, unquote_plus
 
 # Try yt_dlp first, fallback to youtube_dl
 try:
@@ -17,52 +29,446 @@ except ImportError:
     from youtube_dl import YoutubeDL
     using_module = 'youtube_dl'
 
+# orjson is optional: it is faster and serializes straight to bytes
+try:
+    import orjson
+    _dumps, _loads = orjson.dumps, orjson.loads
+except ImportError:
+    _dumps, _loads = lambda o: json.dumps(o).encode(), json.loads
+
+# Finished downloads are cached here as {video_id}_{height}p.mp4
+# Kept without a trailing separator so paths can be built with f"{DOWNLOAD_DIR}/{name}"
+DOWNLOAD_DIR = os.path.abspath('downloads').rstrip(os.sep)
+if not os.path.isdir(DOWNLOAD_DIR):
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+
 # --- Core Functions ---
+_VIDEO_ID_RE = re.compile(r"(?:v=|youtu\.be/|embed/)([0-9A-Za-z_-]{11})")
+
+
 def parse_video_id(url: str) -> str:
-    patterns = [r"v=([0-9A-Za-z_-]{11})", r"youtu\.be/([0-9A-Za-z_-]{11})", r"embed/([0-9A-Za-z_-]{11})"]
-    for pat in patterns:
-        m = re.search(pat, url)
-        if m:
-            return m.group(1)
+    m = _VIDEO_ID_RE.search(url)
+    if m:
+        return m.group(1)
     raise ValueError(f"Invalid YouTube URL: {url}")
 
 
-def get_video_info(url: str) -> dict:
-    ydl_opts = {'quiet': True, 'skip_download': True}
-    with YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(url, download=False)
+_RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[tuple]:
+    m = _RANGE_RE.match(header or '')
+    if not m or not (m.group(1) or m.group(2)):
+        return None
+    if m.group(1):
+        start, end = int(m.group(1)), min(int(m.group(2) or size - 1), size - 1)
+    else:
+        # Suffix form 'bytes=-N': the last N bytes, as players use to find a trailing moov
+        start, end = max(size - int(m.group(2)), 0), size - 1
+    if start > end:
+        raise ValueError(f"Unsatisfiable range: {header}")
+    return start, end
+
+def _parse_query(query: str) -> dict:
+    params: dict = {}
+    for kv in query.split('&'):
+        k, _, v = kv.partition('=')
+        if k: params.setdefault(unquote_plus(k), unquote_plus(v))
+    return params
+
+
+# Building a YoutubeDL loads the extractor registry, cookie jar and plugins, so each worker
+# thread keeps one per option set instead (per thread: an instance is not thread-safe).
+_ydl_local = threading.local()
+
+
+def _ydl(**params) -> YoutubeDL:
+    instances = _ydl_local.__dict__.setdefault('instances', {})
+    # repr, not a tuple: download options carry list/dict values
+    key = repr(sorted(params.items()))
+    if key not in instances:
+        instances[key] = YoutubeDL({'quiet': True, **params})
+    return instances[key]
+
+
+# Seconds an extract_info result is reused (e.g. /fetch followed by /download).
+# YouTube's signed stream URLs expire, so keep this short.
+INFO_TTL = 300
+# Videos kept before the least recently used one is dropped
+INFO_CACHE_SIZE = 512
+# video ID -> (time.monotonic() when fetched, info), least recently used first
+_info_cache: OrderedDict = OrderedDict()
+_info_lock = threading.Lock()
+# video ID -> Future of the warm-up extract a fast /fetch started, until it finishes
+_warming: dict = {}
+
+
+def _cached_info(video_id: str) -> Optional[dict]:
+    with _info_lock:
+        hit = _info_cache.get(video_id)
+        if hit and time.monotonic() - hit[0] < INFO_TTL:
+            _info_cache.move_to_end(video_id)
+            return hit[1]
+    return None
+
+
+def _extract_by_id(video_id: str) -> dict:
+    with _info_lock:
+        warming = _warming.get(video_id)
+    # A warm-up already extracting this video is waited for instead of starting a second extract;
+    # it caches before leaving _warming, so checking the cache after it leaves no gap.
+    # One still queued is cancelled and its extract runs here, without waiting for a free worker.
+    if warming is not None:
+        if not warming.cancel():
+            return warming.result()
+        with _info_lock:
+            # cancel() keeps succeeding for later waiters, so only the one that drops the entry frees its slot
+            dropped = _warming.get(video_id) is warming
+            if dropped:
+                del _warming[video_id]
+        if dropped:
+            _WARM_SLOTS.release()
+    info = _cached_info(video_id)
+    if info is not None:
+        return info
+    return _extract_fresh(video_id)
+
+
+def _extract_fresh(video_id: str) -> dict:
+    now = time.monotonic()
+    info = _ydl(skip_download=True).extract_info(f"https://www.youtube.com/watch?v={video_id}", download=False)
+    with _info_lock:
+        _info_cache[video_id] = (now, info)
+        _info_cache.move_to_end(video_id)
+        while len(_info_cache) > INFO_CACHE_SIZE:
+            _info_cache.popitem(last=False)
+    return info
+
+
+def _extract(url: str) -> dict:
+    return _extract_by_id(parse_video_id(url))
+
+
+# Warms the full extract after a fast /fetch, so /download finds it cached
+_WARM_POOL = ThreadPoolExecutor(max_workers=2)
+# One slot per worker: a /fetch that finds them all taken skips the warm-up instead of queueing it
+_WARM_SLOTS = threading.BoundedSemaphore(2)
+_PLAYER_RESPONSE = 'ytInitialPlayerResponse = '
+
+
+def _warm(video_id: str) -> dict:
+    try:
+        return _extract_fresh(video_id)
+    finally:
+        with _info_lock:
+            _warming.pop(video_id, None)
+        _WARM_SLOTS.release()
+
+def _fast_info(video_id: str) -> dict:
+    req = urllib.request.Request(f"https://www.youtube.com/watch?v={video_id}",
+                                 headers={'User-Agent': 'Mozilla/5.0', 'Accept-Language': 'en'})
+    with urllib.request.urlopen(req, timeout=10) as resp:
+        page = resp.read().decode('utf-8', 'replace')
+    # raw_decode stops at the end of the object; a regex cannot match its nested braces
+    data = json.JSONDecoder().raw_decode(page, page.index(_PLAYER_RESPONSE) + len(_PLAYER_RESPONSE))[0]
+    details, streaming = data['videoDetails'], data['streamingData']
+    return {
+        'title': details['title'],
+        'thumbnail': details['thumbnail']['thumbnails'][-1]['url'],
+        'formats': streaming.get('formats', []) + streaming.get('adaptiveFormats', []),
+    }
+
+
+# i.ytimg.com serves every /vi/ JPEG as WebP under /vi_webp/, typically a third smaller
+_YTIMG_RE = re.compile(r"^(https?://i\d?\.ytimg\.com)/vi(?:_webp)?/([^/]+)/([^/?.]+)\.(?:jpg|webp)(?:\?.*)?$")
+
+
+def _thumbnail_url(url: str) -> str:
+    "Return the WebP variant of an i.ytimg.com thumbnail, without its tracking query; other URLs unchanged."
+    m = _YTIMG_RE.match(url)
+    return f"{m.group(1)}/vi_webp/{m.group(2)}/{m.group(3)}.webp" if m else url
+
+
+def _get_video_info_by_id(video_id: str) -> dict:
+    info = _cached_info(video_id)
+    if info is None:
+        # The watch page answers /fetch without yt_dlp's extractor machinery; consent
+        # walls, age gates and network errors fall back to the full extract
+        try:
+            info = _fast_info(video_id)
+            with _info_lock:
+                if video_id not in _warming and _WARM_SLOTS.acquire(blocking=False):
+                    _warming[video_id] = _WARM_POOL.submit(_warm, video_id)
+        except (OSError, ValueError, LookupError):
+            info = _extract_by_id(video_id)
     return {
         'title': info.get('title'),
-        'thumbnail_url': info.get('thumbnail', ''),
+        'thumbnail_url': _thumbnail_url(info.get('thumbnail') or ''),
         'qualities': sorted({f"{fmt.get('height')}p" for fmt in info.get('formats', []) if fmt.get('height')}),
         'module': using_module
     }
 
 
+def get_video_info(url: str) -> dict:
+    return _get_video_info_by_id(parse_video_id(url))
+
+
+# One background worker, so deleting temp dirs never holds up a request thread
+_CLEANUP_POOL = ThreadPoolExecutor(max_workers=1)
+# Downloads are ffmpeg- and bandwidth-bound: past a handful at once they only thrash, so the rest wait here
+_JOB_SLOTS = threading.BoundedSemaphore(4)
+
+# yt_dlp's own downloader: fetch DASH fragments 4 at a time and plain streams as 10 MiB
+# range requests. aria2c, when installed, splits each stream over 16 connections instead.
+_DOWNLOAD_OPTS = {'concurrent_fragment_downloads': 4, 'http_chunk_size': 10 << 20}
+if shutil.which('aria2c'):
+    _DOWNLOAD_OPTS['external_downloader'] = {'default': 'aria2c'} if using_module == 'yt_dlp' else 'aria2c'
+    _DOWNLOAD_OPTS['external_downloader_args'] = ['-x16', '-s16', '-k1M']
+
+def _ydl_download(url: str, fmt_select: str, tmpdir: str) -> str:
+    ydl = _ydl(format=fmt_select, outtmpl='%(id)s.%(ext)s', merge_output_format='mp4', **_DOWNLOAD_OPTS)
+    # The instance is shared across calls, so only point its output at this call's tmpdir
+    if using_module == 'yt_dlp':
+        ydl.params['paths'] = {'home': tmpdir}
+    else:
+        ydl.params['outtmpl'] = os.path.join(tmpdir, '%(id)s.%(ext)s')
+    info = ydl.process_ie_result(copy.deepcopy(_extract(url)), download=True)
+    # yt_dlp reports where the merged file landed; only youtube_dl needs the tmpdir probed
+    tmp_file = (info.get('requested_downloads') or [{}])[0].get('filepath')
+    if not tmp_file:
+        tmp_file = f"{tmpdir}/{info.get('id')}.mp4"
+        if not os.path.exists(tmp_file):
+            files = os.listdir(tmpdir)
+            if files:
+                tmp_file = f"{tmpdir}/{files[0]}"
+    return tmp_file
+
+
+def _download_and_merge(url: str, resolution: str) -> str:
+    height = int(resolution.rstrip('p'))
+    cache_path = f"{DOWNLOAD_DIR}/{parse_video_id(url)}_{height}p.mp4"
+    if os.path.exists(cache_path):
+        # mtime marks last use for the sweep; atime is unreliable under relatime/noatime
+        os.utime(cache_path)
+        return cache_path
+    fmt_select = f"bestvideo[height<={height}]+bestaudio/best"
+    # Stage inside DOWNLOAD_DIR so the cache entry appears with one same-filesystem rename
+    tmpdir = tempfile.mkdtemp(prefix='.ytdl_', dir=DOWNLOAD_DIR)
+    try:
+        with _JOB_SLOTS:
+            tmp_file = _ydl_download(url, fmt_select, tmpdir)
+    except Exception:
+        # Partial streams and .part files would otherwise pile up in the temp dir
+        _CLEANUP_POOL.submit(shutil.rmtree, tmpdir, True)
+        raise
+    os.replace(tmp_file, cache_path)
+    _CLEANUP_POOL.submit(shutil.rmtree, tmpdir, True)
+    return cache_path
+
+# Downloads in progress, (video_id, height) -> Event; the leader leaves its path or
+# exception on event.result for every request that arrived while it ran
+_inflight = {}
+_inflight_lock = threading.Lock()
+
 def download_and_merge(url: str, resolution: str) -> str:
+    key = (parse_video_id(url), int(resolution.rstrip('p')))
+    with _inflight_lock:
+        event = _inflight.get(key)
+        leader = event is None
+        if leader:
+            event = _inflight[key] = threading.Event()
+    if not leader:
+        event.wait()
+        if isinstance(event.result, Exception): raise event.result
+        return event.result
+    try:
+        event.result = _download_and_merge(url, resolution)
+    except Exception as e:
+        event.result = e
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+        event.set()
+    return event.result
+
+# Bytes of cached downloads kept in DOWNLOAD_DIR (--cache-quota), checked every CACHE_SWEEP_INTERVAL seconds
+CACHE_QUOTA = 20 << 30
+CACHE_SWEEP_INTERVAL = 300
+
+def _sweep_cache():
+    # DirEntry caches its stat, so the directory is walked and stat'ed once
+    entries = sorted((e for e in os.scandir(DOWNLOAD_DIR) if e.is_file() and e.name.endswith('.mp4')),
+                     key=lambda e: e.stat().st_mtime)
+    total = sum(e.stat().st_size for e in entries)
+    for e in entries:
+        if total <= CACHE_QUOTA: break
+        try:
+            os.remove(e.path)
+        except OSError:
+            continue
+        total -= e.stat().st_size
+
+def _sweep_loop():
+    while True:
+        time.sleep(CACHE_SWEEP_INTERVAL)
+        try:
+            _sweep_cache()
+        except OSError:
+            pass
+
+# ffmpeg output we discard goes to one shared handle instead of a fresh os.devnull open per run
+_DEVNULL = open(os.devnull, 'wb')
+
+def resolve_streams(url: str, resolution: str) -> dict:
     height = int(resolution.rstrip('p'))
     fmt_select = f"bestvideo[height<={height}]+bestaudio/best"
-    tmpdir = tempfile.mkdtemp(prefix='ytdl_')
-    outtmpl = os.path.join(tmpdir, '%(id)s.%(ext)s')
-    ydl_opts = {'quiet': True, 'format': fmt_select, 'outtmpl': outtmpl, 'merge_output_format': 'mp4'}
-    with YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(url, download=True)
-    vid = info.get('id')
-    path = os.path.join(tmpdir, f"{vid}.mp4")
-    if not os.path.exists(path):
-        files = os.listdir(tmpdir)
-        if files:
-            path = os.path.join(tmpdir, files[0])
-    return path
+    return _ydl(format=fmt_select).process_ie_result(copy.deepcopy(_extract(url)), download=False)
+
+def _ffmpeg_inputs(fmt: dict) -> list:
+    headers = ''.join(f"{k}: {v}\r\n" for k, v in (fmt.get('http_headers') or {}).items())
+    return (['-headers', headers] if headers else []) + ['-i', fmt['url']]
+
+def _ffmpeg_can_fetch(fmts: list) -> bool:
+    # YouTube throttles one long unranged GET; formats carrying downloader_options (http_chunk_size)
+    # come down through yt_dlp's ranged downloader instead, as do manifests and fragmented formats
+    return all(f.get('protocol') in ('http', 'https') and not f.get('downloader_options') for f in fmts)
+
+
+def open_merged_stream(url: str, resolution: str) -> Optional[tuple]:
+    # Fragmented mp4 needs no seek back to write moov, so ffmpeg can mux straight into a pipe
+    info = resolve_streams(url, resolution)
+    fmts = info.get('requested_formats') or [info]
+    if not _ffmpeg_can_fetch(fmts):
+        return None
+    cmd = ['ffmpeg', '-v', 'error']
+    for fmt in fmts: cmd += _ffmpeg_inputs(fmt)
+    if len(fmts) > 1: cmd += ['-map', '0:v:0', '-map', '1:a:0']
+    cmd += ['-c', 'copy', '-movflags', 'frag_keyframe+empty_moov+default_base_moof', '-f', 'mp4', 'pipe:1']
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=_DEVNULL)
+    return f"{info.get('id')}.mp4", proc
 
 # --- HTTP Handler ---
 class YouTubeHandler(BaseHTTPRequestHandler):
-    def _set_headers(self, status=200, content_type='application/json', extra=None):
+    # Seconds a client may stall on any socket read or write before its pool thread is freed
+    timeout = 60
+    # Keep-alive, so /fetch and the /download after it share a connection; every response
+    # therefore carries a Content-Length or is sent chunked
+    protocol_version = 'HTTP/1.1'
+    # Seconds an idle keep-alive connection may hold its pool worker while waiting for the next request
+    keepalive_timeout = 2
+
+    def setup(self):
+        super().setup()
+        # Small header/JSON writes must not wait on Nagle for an ACK
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle_one_request(self):
+        # Wait for the request line with the short idle timeout, then allow the full one for the exchange
+        self.connection.settimeout(self.keepalive_timeout)
+        try:
+            # peek leaves the bytes in rfile's buffer; an empty result means the client hung up
+            idle = not self.rfile.peek(1)
+        except (TimeoutError, ConnectionError):
+            idle = True
+        if idle: self.close_connection = True; return
+        self.connection.settimeout(self.timeout)
+        super().handle_one_request()
+
+    def _set_headers(self, status: int = 200, content_type: str = 'application/json', extra=None, body=None):
         self.send_response(status)
         self.send_header('Content-Type', content_type)
         if extra:
             for k, v in extra.items(): self.send_header(k, v)
-        self.end_headers()
+        if body is not None:
+            # JSON payloads are a few KiB: level 1 gets most of the size win for next to no CPU
+            if content_type == 'application/json':
+                self.send_header('Vary', 'Accept-Encoding')
+                if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    body = gzip.compress(body, compresslevel=1)
+                    self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(body)))
+        # Corked, the header flush and the body leave as one segment instead of two small ones
+        cork = body is not None and hasattr(socket, 'TCP_CORK')
+        if cork: self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+        try:
+            self.end_headers()
+            if body is not None: self.wfile.write(body)
+        finally:
+            if cork: self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+
+    def _send_file(self, path, extra=None):
+        "Send path as video/mp4: 200, or 206 for a satisfiable Range header, headers coalesced with the body."
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            try:
+                rng = parse_range(self.headers.get('Range'), size)
+            except ValueError:
+                self._set_headers(416, 'text/plain', {'Content-Range': f'bytes */{size}', 'Content-Length': '0'})
+                return
+            start, end = rng or (0, size - 1)
+            count = end - start + 1
+            status = 206 if rng else 200
+            hdrs = {'Server': self.version_string(), 'Date': self.date_time_string(),
+                    'Content-Type': 'video/mp4', 'Content-Length': str(count), 'Accept-Ranges': 'bytes', **(extra or {})}
+            if rng:
+                hdrs['Content-Range'] = f'bytes {start}-{end}/{size}'
+            head = f"{self.protocol_version} {status} {self.responses[status][0]}\r\n"
+            head += ''.join(f"{k}: {v}\r\n" for k, v in hdrs.items()) + "\r\n"
+            self.log_request(status, count)
+            # Status line, headers and the first chunk leave in a single send; socket.sendfile
+            # moves the rest with os.sendfile, or through _send_range's buffer where that is unavailable.
+            # On Linux, TCP_CORK holds partial frames until uncorked so the body goes out in full segments.
+            f.seek(start)
+            first = f.read(min(64 * 1024, count))
+            cork = hasattr(socket, 'TCP_CORK')
+            if cork: self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+            try:
+                self.connection.sendall(head.encode('latin-1') + first)
+                if count > len(first): self._send_range(f, start + len(first), count - len(first))
+            except Exception as e:
+                # The status line is out: a 400 now would land inside the body, so end the response by closing
+                self.close_connection = True
+                self.log_error("Transfer aborted: %r", e)
+            finally:
+                if cork: self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+
+    def _send_range(self, f, offset: int, count: int):
+        "Send count bytes of f from offset, reading into one reused 1 MiB buffer when os.sendfile is unavailable."
+        if hasattr(os, 'sendfile'):
+            self.connection.sendfile(f, offset, count); return
+        # socket.sendfile's own fallback allocates a fresh 8 KiB bytes object per send
+        buf = memoryview(bytearray(1 << 20))
+        f.seek(offset)
+        while count > 0:
+            n = f.readinto(buf[:min(count, len(buf))])
+            if not n: break
+            self.connection.sendall(buf[:n]); count -= n
+
+    def _send_stream(self, proc, extra=None):
+        "Relay ffmpeg's stdout as chunked video/mp4 while it is still muxing."
+        with proc:
+            try:
+                # Each chunk is framed in place: its size line goes in the 16 bytes before the data, CRLF after
+                buf = memoryview(bytearray(16 + (1 << 20) + 2))
+                n = proc.stdout.readinto1(buf[16:-2])
+                if not n: raise RuntimeError('ffmpeg produced no output')
+                self._set_headers(200, 'video/mp4', {**(extra or {}), 'Transfer-Encoding': 'chunked'})
+                try:
+                    while n:
+                        head = b'%x\r\n' % n
+                        buf[16 - len(head):16] = head
+                        buf[16 + n:18 + n] = b'\r\n'
+                        self.connection.sendall(buf[16 - len(head):18 + n])
+                        n = proc.stdout.readinto1(buf[16:-2])
+                    if proc.wait() != 0: raise RuntimeError(f'ffmpeg exited with status {proc.returncode}')
+                    self.connection.sendall(b'0\r\n\r\n')
+                except Exception as e:
+                    # The status line is out: withhold the last chunk and close, so the client sees a truncated transfer
+                    self.close_connection = True
+                    self.log_error("Stream aborted: %r", e)
+            finally:
+                proc.kill()
 
     def do_POST(self):
         if self.path != '/fetch':
@@ -70,44 +476,78 @@ class YouTubeHandler(BaseHTTPRequestHandler):
         length = int(self.headers.get('Content-Length', 0))
         body = self.rfile.read(length)
         try:
-            data = json.loads(body)
+            data = _loads(body)
             info = get_video_info(data.get('url',''))
-            self._set_headers()
-            self.wfile.write(json.dumps(info).encode())
+            self._set_headers(body=_dumps(info))
         except Exception as e:
-            self._set_headers(400)
-            self.wfile.write(json.dumps({'error': str(e)}).encode())
+            self._set_headers(400, body=_dumps({'error': str(e)}))
 
     def do_GET(self):
         parsed = urlparse(self.path)
         if parsed.path == '/':
-            self._set_headers(200, 'text/html')
-            self.wfile.write(INDEX_HTML.encode())
+            gz = 'gzip' in self.headers.get('Accept-Encoding', '')
+            extra = {'Cache-Control': 'public, max-age=3600', 'Vary': 'Accept-Encoding'}
+            if gz: extra['Content-Encoding'] = 'gzip'
+            self._set_headers(200, 'text/html', extra, body=_INDEX_HTML_GZ if gz else _INDEX_HTML_BYTES)
             return
         if parsed.path == '/download':
-            params = parse_qs(parsed.query)
-            url = params.get('url',[''])[0]
-            res = params.get('resolution',[''])[0]
+            params = _parse_query(parsed.query)
+            url = params.get('url','')
+            res = params.get('resolution','')
             try:
-                filepath = download_and_merge(unquote(url), unquote(res))
-                size = os.path.getsize(filepath)
+                if params.get('stream') == '1':
+                    # The slot is held until the stream ends: ffmpeg runs for the whole response
+                    with _JOB_SLOTS:
+                        stream = open_merged_stream(url, res)
+                        if stream:
+                            name, proc = stream
+                            self._send_stream(proc, {'Content-Disposition': f'attachment; filename="{name}"'})
+                            return
+                    # Formats yt_dlp fetches in ranged chunks are served from the downloaded file instead
+                filepath = download_and_merge(url, res)
                 name = os.path.basename(filepath)
-                extra = {
-                    'Content-Length': str(size),
-                    'Content-Disposition': f'attachment; filename="{name}"'
-                }
-                self._set_headers(200, 'video/mp4', extra)
-                with open(filepath, 'rb') as f:
-                    while chunk := f.read(1024*512):
-                        self.wfile.write(chunk)
-                os.remove(filepath)
-                os.rmdir(os.path.dirname(filepath))
+                self._send_file(filepath, {'Content-Disposition': f'attachment; filename="{name}"'})
             except Exception as e:
-                self._set_headers(400)
-                self.wfile.write(json.dumps({'error': str(e)}).encode())
+                self._set_headers(400, body=_dumps({'error': str(e)}))
             return
         self.send_error(404)
 
+# --- HTTP Server ---
+# Worker threads are reused across requests and cap how many yt_dlp runs overlap
+_REQUEST_WORKERS = (os.cpu_count() or 1) * 4
+# A worker's worth of requests may queue behind the busy ones; past that, new connections get a 503
+_REQUEST_SLOTS = threading.BoundedSemaphore(_REQUEST_WORKERS * 2)
+_BUSY_RESPONSE = b'HTTP/1.0 503 Service Unavailable\r\nRetry-After: 5\r\nContent-Length: 0\r\n\r\n'
+
+
+class PooledHTTPServer(ThreadingMixIn, HTTPServer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Daemon threads, as ThreadingHTTPServer's were: Ctrl-C exits without waiting on open
+        # connections or downloads, which an executor's joined workers would
+        self._requests = queue.SimpleQueue()
+        for _ in range(_REQUEST_WORKERS):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def process_request(self, request, client_address):
+        if not _REQUEST_SLOTS.acquire(blocking=False):
+            try: request.sendall(_BUSY_RESPONSE)
+            except OSError: pass
+            self.shutdown_request(request)
+            return
+        self._requests.put((request, client_address))
+
+    def _process_pooled(self, request, client_address):
+        try: self.process_request_thread(request, client_address)
+        finally: _REQUEST_SLOTS.release()
+
+    def _worker(self):
+        while (item := self._requests.get()) is not None: self._process_pooled(*item)
+
+    def server_close(self):
+        super().server_close()
+        for _ in range(_REQUEST_WORKERS): self._requests.put(None)
+
 # --- HTML Template with Bootstrap 5 ---
 INDEX_HTML = '''<!doctype html>
 <html lang="en">
@@ -170,31 +610,114 @@ document.getElementById('download').onclick = () => {
 </script>
 </body>
 </html>'''
+# Encoded once: the page is static, and _set_headers sends its Content-Length
+_INDEX_HTML_BYTES = INDEX_HTML.encode('utf-8')
+# Compressed once at the highest level, so gzip-capable browsers get a quarter of the bytes for free
+_INDEX_HTML_GZ = gzip.compress(_INDEX_HTML_BYTES, compresslevel=9)
 
 # --- Tests ---
-class TestParseVideoID(unittest.TestCase):
-    def test_standard(self): self.assertEqual(parse_video_id("https://www.youtube.com/watch?v=dQw4w9WgXcQ"),"dQw4w9WgXcQ")
-    def test_short(self): self.assertEqual(parse_video_id("https://youtu.be/dQw4w9WgXcQ"),"dQw4w9WgXcQ")
-    def test_embed(self): self.assertEqual(parse_video_id("https://www.youtube.com/embed/dQw4w9WgXcQ"),"dQw4w9WgXcQ")
-    def test_invalid(self):
-        with self.assertRaises(ValueError): parse_video_id("not a url")
+# Only defined for --test or a test runner's import: unittest pulls in dozens of modules a server never uses
+if __name__ != '__main__' or '--test' in sys.argv:
+    import unittest
+    from unittest import mock
+
+    class TestParseVideoID(unittest.TestCase):
+        def test_standard(self): self.assertEqual(parse_video_id("https://www.youtube.com/watch?v=dQw4w9WgXcQ"),"dQw4w9WgXcQ")
+        def test_short(self): self.assertEqual(parse_video_id("https://youtu.be/dQw4w9WgXcQ"),"dQw4w9WgXcQ")
+        def test_embed(self): self.assertEqual(parse_video_id("https://www.youtube.com/embed/dQw4w9WgXcQ"),"dQw4w9WgXcQ")
+        def test_v_not_first(self): self.assertEqual(parse_video_id("https://www.youtube.com/watch?feature=share&v=dQw4w9WgXcQ"),"dQw4w9WgXcQ")
+        def test_invalid(self):
+            with self.assertRaises(ValueError): parse_video_id("not a url")
+
+    class TestParseRange(unittest.TestCase):
+        def test_absent(self): self.assertIsNone(parse_range(None, 100))
+        def test_open_ended(self): self.assertEqual(parse_range("bytes=10-", 100),(10,99))
+        def test_clamped(self): self.assertEqual(parse_range("bytes=0-499", 100),(0,99))
+        def test_suffix(self):
+            self.assertEqual(parse_range("bytes=-10", 100),(90,99))
+            self.assertEqual(parse_range("bytes=-500", 100),(0,99))
+        def test_unsatisfiable(self):
+            with self.assertRaises(ValueError): parse_range("bytes=100-", 100)
+            with self.assertRaises(ValueError): parse_range("bytes=-0", 100)
+
+    class TestParseQuery(unittest.TestCase):
+        def test_first_value(self): self.assertEqual(_parse_query("a=1&b=2&a=3"), {'a': '1', 'b': '2'})
+        def test_decoded_once(self): self.assertEqual(_parse_query("url=%2520+x")['url'], '%20 x')
+
+    class TestThumbnailURL(unittest.TestCase):
+        def test_webp(self): self.assertEqual(_thumbnail_url("https://i.ytimg.com/vi/dQw4w9WgXcQ/hqdefault.jpg?sqp=-oaymwE&rs=AOn4"), "https://i.ytimg.com/vi_webp/dQw4w9WgXcQ/hqdefault.webp")
+        def test_other_host(self): self.assertEqual(_thumbnail_url("https://example.com/a.jpg?x=1"), "https://example.com/a.jpg?x=1")
+
+    class TestInfoCache(unittest.TestCase):
+        def setUp(self):
+            # extract_info answers instantly with the ID, so only the cache's own bookkeeping runs
+            ydl = mock.Mock(extract_info=lambda url, download: {'id': url[-11:]})
+            patcher = mock.patch.dict(globals(), _ydl=lambda **params: ydl, _info_cache=OrderedDict(), INFO_CACHE_SIZE=2)
+            patcher.start(); self.addCleanup(patcher.stop)
+        def test_evicts_least_recently_used(self):
+            _extract_fresh("aaaaaaaaaaa"); _extract_fresh("bbbbbbbbbbb")
+            _cached_info("aaaaaaaaaaa")
+            _extract_fresh("ccccccccccc")
+            self.assertEqual(list(_info_cache), ["aaaaaaaaaaa", "ccccccccccc"])
+        def test_expires_after_ttl(self):
+            _info_cache["aaaaaaaaaaa"] = (time.monotonic() - INFO_TTL - 1, {'id': "stale"})
+            self.assertIsNone(_cached_info("aaaaaaaaaaa"))
+            self.assertEqual(_extract_by_id("aaaaaaaaaaa"), {'id': "aaaaaaaaaaa"})
+            self.assertEqual(_cached_info("aaaaaaaaaaa"), {'id': "aaaaaaaaaaa"})
+
+    class TestSweepCache(unittest.TestCase):
+        def test_oldest_removed_until_under_quota(self):
+            with tempfile.TemporaryDirectory() as d, mock.patch.dict(globals(), DOWNLOAD_DIR=d, CACHE_QUOTA=250):
+                # 300 bytes of .mp4, oldest first; the older .txt is not a download and is left alone
+                for mtime, name in enumerate(["notes.txt", "a.mp4", "b.mp4", "c.mp4"]):
+                    with open(f"{d}/{name}", 'wb') as f: f.write(b'x' * 100)
+                    os.utime(f"{d}/{name}", (mtime, mtime))
+                _sweep_cache()
+                self.assertEqual(sorted(os.listdir(d)), ["b.mp4", "c.mp4", "notes.txt"])
+
+    class TestSingleflight(unittest.TestCase):
+        def _race(self, run):
+            "Call download_and_merge from four threads while the first call is held in run; return what each got."
+            gate, results = threading.Event(), []
+            def held(url, resolution): gate.wait(); return run()
+            def call():
+                try: results.append(download_and_merge("https://youtu.be/dQw4w9WgXcQ", "720p"))
+                except Exception as e: results.append(e)
+            with mock.patch.dict(globals(), _download_and_merge=mock.Mock(side_effect=held)):
+                threads = [threading.Thread(target=call) for _ in range(4)]
+                for t in threads: t.start()
+                # Callers only share the run if they arrive while it is still going
+                time.sleep(0.2); gate.set()
+                for t in threads: t.join()
+                self.assertEqual(_download_and_merge.call_count, 1)
+            return results
+        def test_shared_result(self): self.assertEqual(self._race(lambda: "/cache/a.mp4"), ["/cache/a.mp4"] * 4)
+        def test_shared_exception(self):
+            error = RuntimeError("download failed")
+            def fail(): raise error
+            self.assertEqual(self._race(fail), [error] * 4)
+            self.assertEqual(_inflight, {})
 
 # --- Entry Point ---
 def main():
+    global CACHE_QUOTA
     parser = argparse.ArgumentParser(description="YouTube Downloader Web Server")
     parser.add_argument('--test', action='store_true')
     parser.add_argument('--host', default='0.0.0.0')
     parser.add_argument('--port', type=int, default=5111)
+    parser.add_argument('--cache-quota', type=float, default=CACHE_QUOTA / (1 << 30), help='GiB of downloads to keep cached')
     args = parser.parse_args()
     if args.test:
         unittest.main(argv=[sys.argv[0]])
     else:
+        CACHE_QUOTA = int(args.cache_quota * (1 << 30))
+        threading.Thread(target=_sweep_loop, daemon=True).start()
         try:
-            server = ThreadingHTTPServer((args.host, args.port), YouTubeHandler)
+            server = PooledHTTPServer((args.host, args.port), YouTubeHandler)
             print(f"Server on {args.host}:{args.port}")
         except OSError:
             print("Port busy, using ephemeral", file=sys.stderr)
-            server = ThreadingHTTPServer((args.host, 0), YouTubeHandler)
+            server = PooledHTTPServer((args.host, 0), YouTubeHandler)
             print(f"Server on {args.host}:{server.server_address[1]}")
         server.serve_forever()
 
@@ -2,15 +2,25 @@
 import sys
 import re
 import argparse
-import unittest
 import json
+import gzip
 import os
+import socket
 import tempfile
+import shutil
+import time
+import copy
+import threading
+import queue
 import subprocess
 import math
-import shutil
-from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
-from urllib.parse import urlparse, parse_qs, unquote, quote
+from collections import OrderedDict
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+import urllib.request
+from urllib.parse import urlparse, unquote_plus, quote
 
 # Try yt_dlp first, fallback to youtube_dl
 try:
@@ -20,84 +30,314 @@ except ImportError:
     from youtube_dl import YoutubeDL
     using_module = 'youtube_dl'
 
+# orjson is optional: it is faster and serializes straight to bytes
+try:
+    import orjson
+    _dumps, _loads = orjson.dumps, orjson.loads
+except ImportError:
+    _dumps, _loads = lambda o: json.dumps(o).encode(), json.loads
+
 # Directory for final segments
-DOWNLOAD_DIR = os.path.abspath('downloads')
+# Kept without a trailing separator so paths can be built with f"{DOWNLOAD_DIR}/{name}"
+DOWNLOAD_DIR = os.path.abspath('downloads').rstrip(os.sep)
 if not os.path.isdir(DOWNLOAD_DIR):
     os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 
 # --- Core Functions ---
 
+_VIDEO_ID_RE = re.compile(r"(?:v=|youtu\.be/|embed/)([0-9A-Za-z_-]{11})")
+
+
 def parse_video_id(url: str) -> str:
     "Extract YouTube video ID from URL."  
-    patterns = [r"v=([0-9A-Za-z_-]{11})", r"youtu\.be/([0-9A-Za-z_-]{11})", r"embed/([0-9A-Za-z_-]{11})"]
-    for pat in patterns:
-        m = re.search(pat, url)
-        if m:
-            return m.group(1)
+    m = _VIDEO_ID_RE.search(url)
+    if m:
+        return m.group(1)
     raise ValueError(f"Invalid YouTube URL: {url}")
 
 
-def get_video_info(url: str) -> dict:
+_RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[tuple]:
+    "Return inclusive (start, end) for a 'bytes=start-[end]' or 'bytes=-suffix' Range header, or None to send the whole file."  
+    m = _RANGE_RE.match(header or '')
+    if not m or not (m.group(1) or m.group(2)):
+        return None
+    if m.group(1):
+        start, end = int(m.group(1)), min(int(m.group(2) or size - 1), size - 1)
+    else:
+        # Suffix form 'bytes=-N': the last N bytes, as players use to find a trailing moov
+        start, end = max(size - int(m.group(2)), 0), size - 1
+    if start > end:
+        raise ValueError(f"Unsatisfiable range: {header}")
+    return start, end
+
+
+def _parse_query(query: str) -> dict:
+    "Decode a query string once into {key: first value}."  
+    params: dict = {}
+    for kv in query.split('&'):
+        k, _, v = kv.partition('=')
+        if k: params.setdefault(unquote_plus(k), unquote_plus(v))
+    return params
+
+
+# Building a YoutubeDL loads the extractor registry, cookie jar and plugins, so each worker
+# thread keeps one per option set instead (per thread: an instance is not thread-safe).
+_ydl_local = threading.local()
+
+
+def _ydl(**params) -> YoutubeDL:
+    "Return this thread's long-lived YoutubeDL for params (quiet is implied)."  
+    instances = _ydl_local.__dict__.setdefault('instances', {})
+    key = tuple(sorted(params.items()))
+    if key not in instances:
+        instances[key] = YoutubeDL({'quiet': True, **params})
+    return instances[key]
+
+
+# Seconds an extract_info result is reused (e.g. /fetch followed by /download).
+# YouTube's signed stream URLs expire, so keep this short.
+INFO_TTL = 300
+# Videos kept before the least recently used one is dropped
+INFO_CACHE_SIZE = 512
+# video ID -> (time.monotonic() when fetched, info), least recently used first
+_info_cache: OrderedDict = OrderedDict()
+_info_lock = threading.Lock()
+# video ID -> Future of the warm-up extract a fast /fetch started, until it finishes
+_warming: dict = {}
+
+
+def _cached_info(video_id: str) -> Optional[dict]:
+    "Return the cached extract_info for video_id if younger than INFO_TTL, else None."  
+    with _info_lock:
+        hit = _info_cache.get(video_id)
+        if hit and time.monotonic() - hit[0] < INFO_TTL:
+            _info_cache.move_to_end(video_id)
+            return hit[1]
+    return None
+
+
+def _extract_by_id(video_id: str) -> dict:
+    "Return extract_info for video_id, reusing a result younger than INFO_TTL."  
+    with _info_lock:
+        warming = _warming.get(video_id)
+    # A warm-up already extracting this video is waited for instead of starting a second extract;
+    # it caches before leaving _warming, so checking the cache after it leaves no gap.
+    # One still queued is cancelled and its extract runs here, without waiting for a free worker.
+    if warming is not None:
+        if not warming.cancel():
+            return warming.result()
+        with _info_lock:
+            # cancel() keeps succeeding for later waiters, so only the one that drops the entry frees its slot
+            dropped = _warming.get(video_id) is warming
+            if dropped:
+                del _warming[video_id]
+        if dropped:
+            _WARM_SLOTS.release()
+    info = _cached_info(video_id)
+    if info is not None:
+        return info
+    return _extract_fresh(video_id)
+
+
+def _extract_fresh(video_id: str) -> dict:
+    "Run extract_info for video_id and cache the result."  
+    now = time.monotonic()
+    info = _ydl(skip_download=True).extract_info(f"https://www.youtube.com/watch?v={video_id}", download=False)
+    with _info_lock:
+        _info_cache[video_id] = (now, info)
+        _info_cache.move_to_end(video_id)
+        while len(_info_cache) > INFO_CACHE_SIZE:
+            _info_cache.popitem(last=False)
+    return info
+
+
+def _extract(url: str) -> dict:
+    "Return raw extract_info for url, cached per video ID."  
+    return _extract_by_id(parse_video_id(url))
+
+
+# Warms the full extract after a fast /fetch, so /download finds it cached
+_WARM_POOL = ThreadPoolExecutor(max_workers=2)
+# One slot per worker: a /fetch that finds them all taken skips the warm-up instead of queueing it
+_WARM_SLOTS = threading.BoundedSemaphore(2)
+_PLAYER_RESPONSE = 'ytInitialPlayerResponse = '
+
+
+def _warm(video_id: str) -> dict:
+    "Run the full extract for video_id in the background, then drop its _warming entry and free its slot."  
+    try:
+        return _extract_fresh(video_id)
+    finally:
+        with _info_lock:
+            _warming.pop(video_id, None)
+        _WARM_SLOTS.release()
+
+
+def _fast_info(video_id: str) -> dict:
+    "Return title, thumbnail and formats from the watch page's player response, shaped like extract_info."  
+    req = urllib.request.Request(f"https://www.youtube.com/watch?v={video_id}",
+                                 headers={'User-Agent': 'Mozilla/5.0', 'Accept-Language': 'en'})
+    with urllib.request.urlopen(req, timeout=10) as resp:
+        page = resp.read().decode('utf-8', 'replace')
+    # raw_decode stops at the end of the object; a regex cannot match its nested braces
+    data = json.JSONDecoder().raw_decode(page, page.index(_PLAYER_RESPONSE) + len(_PLAYER_RESPONSE))[0]
+    details, streaming = data['videoDetails'], data['streamingData']
+    return {
+        'title': details['title'],
+        'thumbnail': details['thumbnail']['thumbnails'][-1]['url'],
+        'formats': streaming.get('formats', []) + streaming.get('adaptiveFormats', []),
+    }
+
+
+# i.ytimg.com serves every /vi/ JPEG as WebP under /vi_webp/, typically a third smaller
+_YTIMG_RE = re.compile(r"^(https?://i\d?\.ytimg\.com)/vi(?:_webp)?/([^/]+)/([^/?.]+)\.(?:jpg|webp)(?:\?.*)?$")
+
+
+def _thumbnail_url(url: str) -> str:
+    "Return the WebP variant of an i.ytimg.com thumbnail, without its tracking query; other URLs unchanged."  
+    m = _YTIMG_RE.match(url)
+    return f"{m.group(1)}/vi_webp/{m.group(2)}/{m.group(3)}.webp" if m else url
+
+
+def _get_video_info_by_id(video_id: str) -> dict:
     "Return title, thumbnail and available qualities."  
-    opts = {'quiet': True, 'skip_download': True}
-    with YoutubeDL(opts) as ydl:
-        info = ydl.extract_info(url, download=False)
+    info = _cached_info(video_id)
+    if info is None:
+        # The watch page answers /fetch without yt_dlp's extractor machinery; consent
+        # walls, age gates and network errors fall back to the full extract
+        try:
+            info = _fast_info(video_id)
+            with _info_lock:
+                if video_id not in _warming and _WARM_SLOTS.acquire(blocking=False):
+                    _warming[video_id] = _WARM_POOL.submit(_warm, video_id)
+        except (OSError, ValueError, LookupError):
+            info = _extract_by_id(video_id)
     return {
         'title': info.get('title'),
-        'thumbnail_url': info.get('thumbnail', ''),
+        'thumbnail_url': _thumbnail_url(info.get('thumbnail') or ''),
         'qualities': sorted({f"{fmt.get('height')}p" for fmt in info.get('formats',[]) if fmt.get('height')}),
         'module': using_module
     }
 
 
-def download_and_merge(url: str, resolution: str) -> str:
-    "Download and merge video+audio; return filepath."  
+def get_video_info(url: str) -> dict:
+    "Return title, thumbnail and available qualities for url; youtu.be and watch links share one entry."  
+    return _get_video_info_by_id(parse_video_id(url))
+
+
+# ffmpeg output we discard goes to one shared handle instead of a fresh os.devnull open per run
+_DEVNULL = open(os.devnull, 'wb')
+
+
+def resolve_streams(url: str, resolution: str) -> dict:
+    "Select video+audio formats for resolution from the cached info, without downloading."  
     height = int(resolution.rstrip('p'))
     fmt = f"bestvideo[height<={height}]+bestaudio/best"
-    tmpdir = tempfile.mkdtemp(prefix='ytdl_')
-    outtmpl = os.path.join(tmpdir, '%(id)s.%(ext)s')
-    opts = {'quiet': True, 'format': fmt, 'outtmpl': outtmpl, 'merge_output_format': 'mp4'}
-    with YoutubeDL(opts) as ydl:
-        info = ydl.extract_info(url, download=True)
-    vid = info.get('id')
-    path = os.path.join(tmpdir, f"{vid}.mp4")
+    return _ydl(format=fmt).process_ie_result(copy.deepcopy(_extract(url)), download=False)
+
+
+def _ffmpeg_inputs(fmt: dict) -> list:
+    "ffmpeg/ffprobe input args for one selected format, with its HTTP headers."  
+    headers = ''.join(f"{k}: {v}\r\n" for k, v in (fmt.get('http_headers') or {}).items())
+    return (['-headers', headers] if headers else []) + ['-i', fmt['url']]
+
+
+def _ffmpeg_can_fetch(fmts: list) -> bool:
+    "Whether ffmpeg can read every format straight from its URL: plain http(s) that yt_dlp would not fetch in ranged chunks."  
+    # YouTube throttles one long unranged GET; formats carrying downloader_options (http_chunk_size)
+    # come down through yt_dlp's ranged downloader instead, as do manifests and fragmented formats
+    return all(f.get('protocol') in ('http', 'https') and not f.get('downloader_options') for f in fmts)
+
+
+def _ydl_download(info: dict, tmpdir: str) -> str:
+    "Download and merge the formats selected in info with yt_dlp into tmpdir, return the merged file's path."  
+    ydl = _ydl(outtmpl='%(id)s.%(ext)s', merge_output_format='mp4')
+    # The instance is shared across calls, so only point its output at this call's tmpdir
+    if using_module == 'yt_dlp':
+        ydl.params['paths'] = {'home': tmpdir}
+    else:
+        ydl.params['outtmpl'] = os.path.join(tmpdir, '%(id)s.%(ext)s')
+    info = copy.deepcopy(info)
+    ydl.process_info(info)
+    path = info.get('filepath') or f"{tmpdir}/{info.get('id')}.mp4"
     if not os.path.exists(path):
-        files = os.listdir(tmpdir)
-        if files: path = os.path.join(tmpdir, files[0])
+        path = os.path.join(tmpdir, next(f for f in os.listdir(tmpdir) if not f.endswith('.part')))
     return path
 
 
-def split_and_resize(filepath: str, orientation: str = 'vertical') -> list:
-    "Split video <=60s segments, crop/rotate based on orientation, resize, save to DOWNLOAD_DIR."  
-    # Probe duration
-    proc = subprocess.run([
-        'ffprobe','-v','error','-show_entries','format=duration',
-        '-of','default=noprint_wrappers=1:nokey=1', filepath
-    ], capture_output=True, text=True)
+def _probe(fmt: dict) -> tuple:
+    "Return (duration, width, height) of a format's stream via one ffprobe run."  
+    proc = subprocess.run(['ffprobe','-v','error','-print_format','json','-show_format','-show_streams',
+                           '-select_streams','v:0', *_ffmpeg_inputs(fmt)], capture_output=True, text=True)
+    try:
+        probe = _loads(proc.stdout)
+    except ValueError:
+        probe = {}
     try:
-        duration = float(proc.stdout.strip())
+        duration = float(probe['format']['duration'])
     except:
         duration = 0.0
-    # Probe resolution
-    proc2 = subprocess.run([
-        'ffprobe','-v','error','-select_streams','v:0',
-        '-show_entries','stream=width,height','-of','csv=p=0', filepath
-    ], capture_output=True, text=True)
     try:
-        in_w, in_h = map(int, proc2.stdout.strip().split(','))
+        in_w, in_h = int(probe['streams'][0]['width']), int(probe['streams'][0]['height'])
     except:
         in_w, in_h = 1280, 720
-    # Determine segments
-    MAX_LEN = 60.0
-    num_segs = max(1, math.ceil(duration / MAX_LEN))
-    seg_len = duration / num_segs if num_segs > 0 else duration
-    base = os.path.splitext(os.path.basename(filepath))[0]
-    tmpdir = os.path.dirname(filepath)
-    seg_paths = []
-    print(f"Duration {duration:.2f}s => {num_segs} segments (~{seg_len:.2f}s each), orientation={orientation}")
-    for i in range(num_segs):
-        start = round(i * seg_len)
-        end = round(min((i + 1) * seg_len, duration))
+    return duration, in_w, in_h
+
+
+# Hardware H.264 encoders by preference, as (name, global args, filter suffix, codec args).
+# Decoding, crop and scale stay on the CPU so one filter chain serves every encoder.
+_HW_ENCODERS = [
+    ('h264_nvenc', [], '', ['-c:v','h264_nvenc','-preset','p1']),
+    ('h264_vaapi', ['-init_hw_device','vaapi=va:/dev/dri/renderD128','-filter_hw_device','va'], ',format=nv12,hwupload', ['-c:v','h264_vaapi']),
+    ('h264_videotoolbox', [], '', ['-c:v','h264_videotoolbox','-realtime','1']),
+]
+# libx264, the fallback when no hardware encoder works
+_SOFTWARE_ENCODER = ([], '', ['-preset','ultrafast'])
+_encoder = None
+
+
+def _video_encoder() -> tuple:
+    "Return (global args, filter suffix, codec args) for the fastest working H.264 encoder, probed once per process."  
+    global _encoder
+    if _encoder is None:
+        listed = subprocess.run(['ffmpeg','-hide_banner','-encoders'], capture_output=True, text=True).stdout
+        encoder = _SOFTWARE_ENCODER
+        for name, pre, suffix, codec in _HW_ENCODERS:
+            if name not in listed: continue
+            # Being compiled in says nothing about the device, so try a tiny encode first
+            trial = subprocess.run(['ffmpeg','-v','error',*pre,'-f','lavfi','-i','color=s=256x256:d=0.1',
+                                    '-vf',f"format=yuv420p{suffix}",*codec,'-f','null','-'],
+                                   stdout=_DEVNULL, stderr=_DEVNULL)
+            if trial.returncode == 0:
+                encoder = (pre, suffix, codec); break
+        _encoder = encoder
+    return _encoder
+
+# Splits are ffmpeg- and bandwidth-bound: past a handful at once they only thrash, so the rest wait here
+_JOB_SLOTS = threading.BoundedSemaphore(4)
+
+
+def split_and_resize(info: dict, orientation: str = 'vertical') -> list:
+    "Stream the selected formats into ffmpeg, split <=60s segments, crop/rotate based on orientation, resize, save to DOWNLOAD_DIR."  
+    fmts = info.get('requested_formats') or [info]
+    # Each run cuts into its own dir under DOWNLOAD_DIR and renames finished segments into place, so
+    # concurrent splits never share a file
+    tmpdir = tempfile.mkdtemp(prefix='.split_', dir=DOWNLOAD_DIR)
+    try:
+        duration, in_w, in_h = info.get('duration'), fmts[0].get('width'), fmts[0].get('height')
+        if not _ffmpeg_can_fetch(fmts):
+            # Formats yt_dlp fetches in ranged chunks come down to the staging dir first; ffmpeg cuts the local file
+            fmts = [{'url': _ydl_download(info, tmpdir)}]
+        if not (duration and in_w and in_h):
+            duration, in_w, in_h = _probe(fmts[0])
+        # Determine segments
+        MAX_LEN = 60.0
+        num_segs = max(1, math.ceil(duration / MAX_LEN))
+        seg_len = duration / num_segs if num_segs > 0 else duration
+        print(f"Duration {duration:.2f}s => {num_segs} segments (~{seg_len:.2f}s each), orientation={orientation}")
         # Build filter
         if orientation == 'vertical':
             crop_h = in_h; crop_w = int(in_h * 9/16)
@@ -105,81 +345,233 @@ def split_and_resize(filepath: str, orientation: str = 'vertical') -> list:
             vf = f"crop={crop_w}:{crop_h}:{crop_x}:{crop_y},scale=720:1280"
         else:
             vf = "transpose=1,scale=1280:720"
-        inter = os.path.join(tmpdir, f"{base}_{start}_{end}.mp4")
-        cmd = [
-            'ffmpeg','-y','-i',filepath,
-            '-ss',str(start),'-to',str(end),
-            '-vf',vf,
-            '-preset','ultrafast','-c:a','copy',inter
-        ]
-        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        final = os.path.join(DOWNLOAD_DIR, os.path.basename(inter))
-        shutil.move(inter, final)
-        print(f"Segment {i+1}/{num_segs}: {start}-{end}s -> {final}")
-        seg_paths.append(final)
+        # ffmpeg pulls the streams itself (no merged file on disk), decodes once and lets the
+        # segment muxer cut into the staging dir; keyframes are forced on the cut points.
+        # The muxer reports each finished segment on stdout, so nothing has to be listed.
+        seg_time = f"{seg_len or MAX_LEN:.3f}"
+        inputs = [arg for f in fmts for arg in _ffmpeg_inputs(f)]
+        if len(fmts) > 1:
+            inputs += ['-map','0:v:0','-map','1:a:0']
+        # Height and orientation in the name keep other variants' links valid
+        base = f"{info.get('id')}_{in_h}p_{'vertical' if orientation == 'vertical' else 'horizontal'}"
+        encoders = [_video_encoder()]
+        # A hardware encoder that passed the probe can still fail on a real input
+        # (size limits, a busy device), so it gets one retry on libx264
+        if encoders[0] != _SOFTWARE_ENCODER:
+            encoders.append(_SOFTWARE_ENCODER)
+        for pre, suffix, codec in encoders:
+            cmd = [
+                'ffmpeg','-y',*pre,*inputs,
+                '-vf',vf + suffix,
+                *codec,'-force_key_frames',f"expr:gte(t,n_forced*{seg_time})",
+                '-c:a','copy',
+                '-f','segment','-segment_time',seg_time,'-reset_timestamps','1','-segment_format','mp4',
+                '-segment_list','pipe:1','-segment_list_type','flat',
+                f"{tmpdir}/{base}_%03d.mp4"
+            ]
+            # Only the successful run's listing is used; a failed run's leftovers go with the staging dir
+            proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=_DEVNULL, text=True)
+            if proc.returncode == 0:
+                break
+        else:
+            raise RuntimeError(f"ffmpeg exited with status {proc.returncode}")
+        names = proc.stdout.split()
+        seg_paths = []
+        for i, name in enumerate(names):
+            final = f"{DOWNLOAD_DIR}/{name}"
+            os.replace(f"{tmpdir}/{name}", final)
+            print(f"Segment {i+1}/{len(names)}: -> {final}")
+            seg_paths.append(final)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
     print(f"Completed {len(seg_paths)} segments in {DOWNLOAD_DIR}")
     return seg_paths
 
 # --- HTTP Handler ---
 class YouTubeHandler(BaseHTTPRequestHandler):
-    def _set_headers(self, status=200, content_type='application/json', extra=None):
+    # Seconds a client may stall on any socket read or write before its pool thread is freed
+    timeout = 60
+    # Keep-alive, so /fetch and the /download after it share a connection; every response
+    # therefore carries a Content-Length or closes the connection
+    protocol_version = 'HTTP/1.1'
+    # Seconds an idle keep-alive connection may hold its pool worker while waiting for the next request
+    keepalive_timeout = 2
+
+    def setup(self):
+        super().setup()
+        # Small header/JSON writes must not wait on Nagle for an ACK
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle_one_request(self):
+        # Wait for the request line with the short idle timeout, then allow the full one for the exchange
+        self.connection.settimeout(self.keepalive_timeout)
+        try:
+            # peek leaves the bytes in rfile's buffer; an empty result means the client hung up
+            idle = not self.rfile.peek(1)
+        except (TimeoutError, ConnectionError):
+            idle = True
+        if idle: self.close_connection = True; return
+        self.connection.settimeout(self.timeout)
+        super().handle_one_request()
+
+    def _set_headers(self, status: int = 200, content_type: str = 'application/json', extra=None, body=None):
         self.send_response(status)
         self.send_header('Content-Type', content_type)
         if extra:
             for k, v in extra.items(): self.send_header(k, v)
-        self.end_headers()
+        if body is not None:
+            # JSON payloads are a few KiB: level 1 gets most of the size win for next to no CPU
+            if content_type == 'application/json':
+                self.send_header('Vary', 'Accept-Encoding')
+                if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    body = gzip.compress(body, compresslevel=1)
+                    self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(body)))
+        # Corked, the header flush and the body leave as one segment instead of two small ones
+        cork = body is not None and hasattr(socket, 'TCP_CORK')
+        if cork: self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+        try:
+            self.end_headers()
+            if body is not None: self.wfile.write(body)
+        finally:
+            if cork: self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+
+    def _send_file(self, path, extra=None):
+        "Send path as video/mp4: 200, or 206 for a satisfiable Range header, headers coalesced with the body."
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            try:
+                rng = parse_range(self.headers.get('Range'), size)
+            except ValueError:
+                self._set_headers(416, 'text/plain', {'Content-Range': f'bytes */{size}', 'Content-Length': '0'})
+                return
+            start, end = rng or (0, size - 1)
+            count = end - start + 1
+            status = 206 if rng else 200
+            hdrs = {'Server': self.version_string(), 'Date': self.date_time_string(),
+                    'Content-Type': 'video/mp4', 'Content-Length': str(count), 'Accept-Ranges': 'bytes', **(extra or {})}
+            if rng:
+                hdrs['Content-Range'] = f'bytes {start}-{end}/{size}'
+            head = f"{self.protocol_version} {status} {self.responses[status][0]}\r\n"
+            head += ''.join(f"{k}: {v}\r\n" for k, v in hdrs.items()) + "\r\n"
+            self.log_request(status, count)
+            # Status line, headers and the first chunk leave in a single send; socket.sendfile
+            # moves the rest with os.sendfile, or through _send_range's buffer where that is unavailable.
+            # On Linux, TCP_CORK holds partial frames until uncorked so the body goes out in full segments.
+            f.seek(start)
+            first = f.read(min(64 * 1024, count))
+            cork = hasattr(socket, 'TCP_CORK')
+            if cork: self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+            try:
+                self.connection.sendall(head.encode('latin-1') + first)
+                if count > len(first): self._send_range(f, start + len(first), count - len(first))
+            except Exception as e:
+                # The status line is out: a 400 now would land inside the body, so end the response by closing
+                self.close_connection = True
+                self.log_error("Transfer aborted: %r", e)
+            finally:
+                if cork: self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+
+    def _send_range(self, f, offset: int, count: int):
+        "Send count bytes of f from offset, reading into one reused 1 MiB buffer when os.sendfile is unavailable."
+        if hasattr(os, 'sendfile'):
+            self.connection.sendfile(f, offset, count); return
+        # socket.sendfile's own fallback allocates a fresh 8 KiB bytes object per send
+        buf = memoryview(bytearray(1 << 20))
+        f.seek(offset)
+        while count > 0:
+            n = f.readinto(buf[:min(count, len(buf))])
+            if not n: break
+            self.connection.sendall(buf[:n]); count -= n
 
     def do_POST(self):
         if self.path == '/fetch':
             length = int(self.headers.get('Content-Length', 0))
             body = self.rfile.read(length)
             try:
-                data = json.loads(body)
+                data = _loads(body)
                 info = get_video_info(data.get('url', ''))
-                self._set_headers()
-                self.wfile.write(json.dumps(info).encode())
+                self._set_headers(body=_dumps(info))
             except Exception as e:
-                self._set_headers(400)
-                self.wfile.write(json.dumps({'error': str(e)}).encode())
+                self._set_headers(400, body=_dumps({'error': str(e)}))
         else:
             self.send_error(404)
 
     def do_GET(self):
         p = urlparse(self.path)
         if p.path == '/':
-            self._set_headers(200, 'text/html')
-            self.wfile.write(INDEX_HTML.encode())
+            gz = 'gzip' in self.headers.get('Accept-Encoding', '')
+            extra = {'Cache-Control': 'public, max-age=3600', 'Vary': 'Accept-Encoding'}
+            if gz: extra['Content-Encoding'] = 'gzip'
+            self._set_headers(200, 'text/html', extra, body=_INDEX_HTML_GZ if gz else _INDEX_HTML_BYTES)
             return
         if p.path == '/split':
-            params = parse_qs(p.query)
-            url = params.get('url', [''])[0]
-            res = params.get('resolution', [''])[0]
-            orient = params.get('orientation', ['vertical'])[0]
+            params = _parse_query(p.query)
+            url = params.get('url', '')
+            res = params.get('resolution', '')
+            orient = params.get('orientation', 'vertical')
             try:
-                fp = download_and_merge(unquote(url), unquote(res))
-                segs = split_and_resize(fp, orient)
+                info = resolve_streams(url, res)
+                with _JOB_SLOTS: segs = split_and_resize(info, orient)
                 host = f"http://{self.server.server_address[0]}:{self.server.server_address[1]}"
                 items = [{'name': os.path.basename(s), 'url': f"{host}/segment?path={quote(s)}"} for s in segs]
-                self._set_headers()
-                self.wfile.write(json.dumps(items).encode())
+                self._set_headers(body=_dumps(items))
             except Exception as e:
-                self._set_headers(400)
-                self.wfile.write(json.dumps({'error': str(e)}).encode())
+                self._set_headers(400, body=_dumps({'error': str(e)}))
             return
         if p.path == '/segment':
-            params = parse_qs(p.query)
-            path = unquote(params.get('path', [''])[0])
+            path = _parse_query(p.query).get('path', '')
             if os.path.exists(path):
-                size = os.path.getsize(path); name = os.path.basename(path)
-                hdr = {'Content-Length': str(size), 'Content-Disposition': f'attachment; filename="{name}"'}
-                self._set_headers(200, 'video/mp4', hdr)
-                with open(path, 'rb') as f:
-                    while chunk := f.read(1024 * 512): self.wfile.write(chunk)
+                name = os.path.basename(path)
+                self._send_file(path, {'Content-Disposition': f'attachment; filename="{name}"'})
             else:
                 self.send_error(404)
             return
         self.send_error(404)
 
+# --- HTTP Server ---
+# Worker threads are reused across requests and cap how many yt_dlp runs overlap
+_REQUEST_WORKERS = (os.cpu_count() or 1) * 4
+# A worker's worth of requests may queue behind the busy ones; past that, new connections get a 503
+_REQUEST_SLOTS = threading.BoundedSemaphore(_REQUEST_WORKERS * 2)
+_BUSY_RESPONSE = b'HTTP/1.0 503 Service Unavailable\r\nRetry-After: 5\r\nContent-Length: 0\r\n\r\n'
+
+
+class PooledHTTPServer(ThreadingMixIn, HTTPServer):
+    "HTTPServer that runs each request on a fixed set of _REQUEST_WORKERS daemon threads."
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Daemon threads, as ThreadingHTTPServer's were: Ctrl-C exits without waiting on open
+        # connections or downloads, which an executor's joined workers would
+        self._requests = queue.SimpleQueue()
+        for _ in range(_REQUEST_WORKERS):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def process_request(self, request, client_address):
+        if not _REQUEST_SLOTS.acquire(blocking=False):
+            try:
+                request.sendall(_BUSY_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        self._requests.put((request, client_address))
+
+    def _process_pooled(self, request, client_address):
+        try:
+            self.process_request_thread(request, client_address)
+        finally:
+            _REQUEST_SLOTS.release()
+
+    def _worker(self):
+        while (item := self._requests.get()) is not None:
+            self._process_pooled(*item)
+
+    def server_close(self):
+        super().server_close()
+        for _ in range(_REQUEST_WORKERS):
+            self._requests.put(None)
+
 # --- HTML Template ---
 INDEX_HTML = '''<!doctype html>
 <html lang="en"><head>
@@ -233,14 +625,60 @@ document.getElementById('split').addEventListener('click',async()=>{
 </script>
 </body>
 </html>'''
+# Encoded once: the page is static, and _set_headers sends its Content-Length
+_INDEX_HTML_BYTES = INDEX_HTML.encode('utf-8')
+# Compressed once at the highest level, so gzip-capable browsers get a quarter of the bytes for free
+_INDEX_HTML_GZ = gzip.compress(_INDEX_HTML_BYTES, compresslevel=9)
 
 # --- Tests ---
-class TestParseVideoID(unittest.TestCase):
-    def test_standard(self): self.assertEqual(parse_video_id("https://www.youtube.com/watch?v=dQw4w9WgXcQ"),"dQw4w9WgXcQ")
-    def test_short(self): self.assertEqual(parse_video_id("https://youtu.be/dQw4w9WgXcQ"),"dQw4w9WgXcQ")
-    def test_embed(self): self.assertEqual(parse_video_id("https://www.youtube.com/embed/dQw4w9WgXcQ"),"dQw4w9WgXcQ")
-    def test_invalid(self):
-        with self.assertRaises(ValueError): parse_video_id("not a url")
+# Only defined for --test or a test runner's import: unittest pulls in dozens of modules a server never uses
+if __name__ != '__main__' or '--test' in sys.argv:
+    import unittest
+    from unittest import mock
+
+    class TestParseVideoID(unittest.TestCase):
+        def test_standard(self): self.assertEqual(parse_video_id("https://www.youtube.com/watch?v=dQw4w9WgXcQ"),"dQw4w9WgXcQ")
+        def test_short(self): self.assertEqual(parse_video_id("https://youtu.be/dQw4w9WgXcQ"),"dQw4w9WgXcQ")
+        def test_embed(self): self.assertEqual(parse_video_id("https://www.youtube.com/embed/dQw4w9WgXcQ"),"dQw4w9WgXcQ")
+        def test_v_not_first(self): self.assertEqual(parse_video_id("https://www.youtube.com/watch?feature=share&v=dQw4w9WgXcQ"),"dQw4w9WgXcQ")
+        def test_invalid(self):
+            with self.assertRaises(ValueError): parse_video_id("not a url")
+
+    class TestParseRange(unittest.TestCase):
+        def test_absent(self): self.assertIsNone(parse_range(None, 100))
+        def test_open_ended(self): self.assertEqual(parse_range("bytes=10-", 100),(10,99))
+        def test_clamped(self): self.assertEqual(parse_range("bytes=0-499", 100),(0,99))
+        def test_suffix(self):
+            self.assertEqual(parse_range("bytes=-10", 100),(90,99))
+            self.assertEqual(parse_range("bytes=-500", 100),(0,99))
+        def test_unsatisfiable(self):
+            with self.assertRaises(ValueError): parse_range("bytes=100-", 100)
+            with self.assertRaises(ValueError): parse_range("bytes=-0", 100)
+
+    class TestParseQuery(unittest.TestCase):
+        def test_first_value(self): self.assertEqual(_parse_query("a=1&b=2&a=3"), {'a': '1', 'b': '2'})
+        def test_decoded_once(self): self.assertEqual(_parse_query("url=%2520+x")['url'], '%20 x')
+
+    class TestThumbnailURL(unittest.TestCase):
+        def test_webp(self): self.assertEqual(_thumbnail_url("https://i.ytimg.com/vi/dQw4w9WgXcQ/hqdefault.jpg?sqp=-oaymwE&rs=AOn4"), "https://i.ytimg.com/vi_webp/dQw4w9WgXcQ/hqdefault.webp")
+        def test_other_host(self): self.assertEqual(_thumbnail_url("https://example.com/a.jpg?x=1"), "https://example.com/a.jpg?x=1")
+
+    class TestInfoCache(unittest.TestCase):
+        def setUp(self):
+            # extract_info answers instantly with the ID, so only the cache's own bookkeeping runs
+            ydl = mock.Mock(extract_info=lambda url, download: {'id': url[-11:]})
+            patcher = mock.patch.dict(globals(), _ydl=lambda **params: ydl, _info_cache=OrderedDict(), INFO_CACHE_SIZE=2)
+            patcher.start(); self.addCleanup(patcher.stop)
+        def test_evicts_least_recently_used(self):
+            _extract_fresh("aaaaaaaaaaa"); _extract_fresh("bbbbbbbbbbb")
+            _cached_info("aaaaaaaaaaa")
+            _extract_fresh("ccccccccccc")
+            self.assertEqual(list(_info_cache), ["aaaaaaaaaaa", "ccccccccccc"])
+        def test_expires_after_ttl(self):
+            _info_cache["aaaaaaaaaaa"] = (time.monotonic() - INFO_TTL - 1, {'id': "stale"})
+            self.assertIsNone(_cached_info("aaaaaaaaaaa"))
+            self.assertEqual(_extract_by_id("aaaaaaaaaaa"), {'id': "aaaaaaaaaaa"})
+            self.assertEqual(_cached_info("aaaaaaaaaaa"), {'id': "aaaaaaaaaaa"})
 
 # --- Entry Point ---
 def main():
@@ -251,11 +689,11 @@ def main():
         unittest.main(argv=[sys.argv[0]])
     else:
         try:
-            srv=ThreadingHTTPServer((args.host,args.port),YouTubeHandler)
+            srv=PooledHTTPServer((args.host,args.port),YouTubeHandler)
             print(f"Server on {args.host}:{args.port}")
         except OSError:
             print("Port busy, using ephemeral",file=sys.stderr)
-            srv=ThreadingHTTPServer((args.host,0),YouTubeHandler)
+            srv=PooledHTTPServer((args.host,0),YouTubeHandler)
             print(f"Server on {args.host}:{srv.server_address[1]}")
         srv.serve_forever()
 